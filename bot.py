@@ -1,14 +1,43 @@
+import asyncio
+import gzip
 import logging
-import requests
-from io import BytesIO
+import aiohttp
+import orjson
+from aiohttp.payload import AsyncIterablePayload
+from cachetools import TTLCache
 from telegram import Update, constants
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from flask import Flask, render_template_string, jsonify, request
-import threading
+from telegram.ext import (
+    AIORateLimiter, Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes
+)
+from flask import Flask, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+import uvicorn
+import contextlib
+import hmac
+import itertools
+import secrets
+import signal
 import time
 import os
 from collections import defaultdict
-from datetime import datetime, timedelta
+from functools import lru_cache, wraps
+
+# uvloop is optional and POSIX-only
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# brotli is optional; without it the index page is served gzip-compressed
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Import configuration
 try:
@@ -23,9 +52,22 @@ except ImportError:
         FLASK_PORT = int(os.getenv('FLASK_PORT', 8080))
         MAX_SIZE_BYTES = MAX_SIZE_MB * 1024 * 1024
         IMGBB_UPLOAD_URL = "https://api.imgbb.com/1/upload"
+        PUBLIC_URL = os.getenv('PUBLIC_URL', '')
+        WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
     
     config = Config()
 
+# Bind hot-path settings once; config does not change at runtime
+MAX_SIZE_MB = config.MAX_SIZE_MB
+MAX_SIZE_BYTES = config.MAX_SIZE_BYTES
+IMGBB_API_KEY = config.IMGBB_API_KEY
+IMGBB_UPLOAD_URL = config.IMGBB_UPLOAD_URL
+
+# Webhook deliveries are authenticated by a secret header, so the path need not hide the token;
+# a fresh secret per run is fine because the webhook is re-registered on every start
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
 # Set up logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -35,33 +77,155 @@ logger = logging.getLogger(__name__)
 
 # Rate Limiter Class
 class RateLimiter:
-    def __init__(self):
-        self.user_requests = defaultdict(list)
+    """Sliding-window counter: two counts per user instead of one timestamp per request."""
+
+    def __init__(self, limit: int = 10, window: int = 60):
+        self.limit = limit
+        self.window = window
+        # user_id -> (window_index, previous_window_count, current_window_count)
+        self.user_requests = {}
     
-    def is_limited(self, user_id: int, limit: int = 10, window: int = 60) -> bool:
+    def is_limited(self, user_id: int) -> bool:
         """Check if user has exceeded rate limit."""
-        now = datetime.now()
-        # Clean old requests
-        self.user_requests[user_id] = [
-            req_time for req_time in self.user_requests[user_id] 
-            if now - req_time < timedelta(seconds=window)
-        ]
-        
-        if len(self.user_requests[user_id]) >= limit:
+        window_index, elapsed = divmod(time.monotonic(), self.window)
+        window_index = int(window_index)
+        stored_index, previous_count, current_count = self.user_requests.get(user_id, (window_index, 0, 0))
+
+        # Roll the counts forward if one or more windows have passed
+        if window_index != stored_index:
+            previous_count = current_count if window_index == stored_index + 1 else 0
+            current_count = 0
+
+        # Weight the previous window by how much of it still overlaps the sliding window
+        estimated = previous_count * (1 - elapsed / self.window) + current_count
+        if estimated >= self.limit:
+            self.user_requests[user_id] = (window_index, previous_count, current_count)
             return True
         
-        self.user_requests[user_id].append(now)
+        self.user_requests[user_id] = (window_index, previous_count, current_count + 1)
         return False
 
+    def sweep(self) -> None:
+        """Forget users whose counts no longer affect the estimate."""
+        current_index = int(time.monotonic() // self.window)
+        for user_id, (window_index, _, _) in list(self.user_requests.items()):
+            if window_index < current_index - 1:
+                del self.user_requests[user_id]
+
 # Initialize rate limiter
 rate_limiter = RateLimiter()
 
+# Upload Counter Class
+class UploadCounter:
+    """Upload count shared between the bot handlers and the Flask worker threads."""
+
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self._value = 0
+
+    def increment(self) -> int:
+        """Record one upload; next() on itertools.count is atomic, unlike `+=` on an int."""
+        self._value = next(self._counter)
+        return self._value
+
+    @property
+    def value(self) -> int:
+        """Number of uploads recorded so far."""
+        return self._value
+
+# Update Processor Class
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, keeping each chat in order."""
+
+    def __init__(self, max_concurrent_updates: int = 256):
+        super().__init__(max_concurrent_updates)
+        self.chat_locks = {}
+        self.pending_updates = defaultdict(int)
+
+    async def process_update(self, update, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Queue on the chat's lock before taking a global slot, so one busy chat cannot hold them all;
+        # asyncio.Lock wakes waiters in FIFO order, so a chat's updates run in arrival order
+        lock = self.chat_locks.setdefault(chat.id, asyncio.Lock())
+        self.pending_updates[chat.id] += 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self.pending_updates[chat.id] -= 1
+            if not self.pending_updates[chat.id]:
+                # Drop the lock as soon as the chat goes idle
+                del self.pending_updates[chat.id]
+                del self.chat_locks[chat.id]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+def timed_lru_cache(seconds: int, maxsize: int = 1):
+    """Like lru_cache, but entries expire once every `seconds`."""
+    def decorator(func):
+        @lru_cache(maxsize=maxsize)
+        def cached(generation, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # The generation changes every `seconds`, which misses the cache
+            return cached(int(time.monotonic() // seconds), *args, **kwargs)
+        return wrapper
+    return decorator
+
+# JSON Provider Class
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Flask App - Use simple Flask without template folder
 flask_app = Flask(__name__)
+flask_app.json = ORJSONProvider(flask_app)
 
 # Add startup time for health checks
 STARTUP_TIME = time.time()
-UPLOAD_COUNTER = 0
+upload_counter = UploadCounter()
+
+# Threads serving Flask requests, matching the old waitress pool
+FLASK_WORKERS = 8
+
+# Subsystem health cached by the probe_health job: name -> (status, checked_at)
+HEALTH_PROBE_INTERVAL = 10
+HEALTH_STALE_AFTER = 30
+subsystem_health = {}
+
+# getFile results by file_id; Telegram keeps download paths valid for about an hour
+file_cache = TTLCache(maxsize=1024, ttl=3000)
+
+# Chunk size used when piping Telegram downloads into ImgBB uploads
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# The download only has to keep making progress; the upload deadline covers the whole
+# transfer, since the download is streamed through it
+TELEGRAM_DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+IMGBB_UPLOAD_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+# Uploads finishing within PROGRESS_DELAY seconds get a single reply and no progress message;
+# files under SMALL_FILE_BYTES also skip the "sending photo" chat action
+PROGRESS_DELAY = 1.5
+SMALL_FILE_BYTES = 500 * 1024
 
 # HTML Template as string to avoid file issues
 HTML_TEMPLATE = '''
@@ -344,18 +508,23 @@ HTML_TEMPLATE = '''
         function updateStats() {
             fetch('/health')
                 .then(response => {
-                    if (!response.ok) throw new Error('Network error');
+                    // 503 still carries the health body, with status "degraded"
+                    if (!response.ok && response.status !== 503) throw new Error('Network error');
                     return response.json();
                 })
                 .then(data => {
                     document.getElementById('uptime').textContent = Math.round(data.uptime);
                     document.getElementById('uploadCount').textContent = data.uploads_processed || 0;
-                    document.getElementById('statusText').textContent = 'Online - ' + Math.round(data.uptime) + ' seconds uptime';
                     
                     const statusElement = document.getElementById('serviceStatus');
                     if (data.status === 'ok') {
+                        document.getElementById('statusText').textContent = 'Online - ' + Math.round(data.uptime) + ' seconds uptime';
                         statusElement.style.background = '#28a745';
                         statusElement.textContent = '● Service Online';
+                    } else {
+                        document.getElementById('statusText').textContent = 'Degraded - ' + Math.round(data.uptime) + ' seconds uptime';
+                        statusElement.style.background = '#ffc107';
+                        statusElement.textContent = '● Service Degraded';
                     }
                 })
                 .catch(error => {
@@ -374,6 +543,18 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+# Compile the page template once rather than on every request
+INDEX_TEMPLATE = flask_app.jinja_env.from_string(HTML_TEMPLATE)
+
+@lru_cache(maxsize=None)
+def _render_index(max_size_mb: int) -> dict:
+    """Render and pre-compress the index page; the output only depends on max_size_mb."""
+    page = INDEX_TEMPLATE.render(max_size_mb=max_size_mb).encode('utf-8')
+    variants = {'gzip': gzip.compress(page, 9), 'identity': page}
+    if brotli is not None:
+        variants['br'] = brotli.compress(page, quality=11)
+    return variants
+
 @flask_app.before_request
 def before_request():
     """Log all requests for debugging."""
@@ -388,11 +569,17 @@ def index():
         elif request.method == 'OPTIONS':
             return '', 200
         
-        # Use render_template_string instead of render_template
-        return render_template_string(
-            HTML_TEMPLATE, 
-            max_size_mb=getattr(config, 'MAX_SIZE_MB', 5)
+        # Serve the best pre-compressed variant the client accepts
+        variants = _render_index(MAX_SIZE_MB)
+        encoding = next(
+            (enc for enc in ('br', 'gzip') if enc in variants and request.accept_encodings[enc]),
+            'identity'
         )
+        response = flask_app.response_class(variants[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
     except Exception as e:
         logger.error(f"Error rendering index: {e}")
         # Fallback JSON response
@@ -400,40 +587,59 @@ def index():
             "name": "Telegram Image Uploader Bot",
             "status": "running",
             "message": "Bot is running successfully",
-            "max_file_size_mb": getattr(config, 'MAX_SIZE_MB', 5),
+            "max_file_size_mb": MAX_SIZE_MB,
             "endpoints": {
                 "/health": "Health check",
                 "/info": "Service information"
             }
         })
 
+@timed_lru_cache(2)
+def _build_health_response() -> tuple:
+    """Build and serialize the /health body; probes within the same 2s share it."""
+    now = time.time()
+    subsystems = {}
+    healthy = True
+    for name in ('telegram', 'imgbb'):
+        status, checked_at = subsystem_health.get(name, ('unknown', None))
+        if status != 'ok' or checked_at is None or now - checked_at > HEALTH_STALE_AFTER:
+            healthy = False
+        subsystems[name] = {"status": status, "checked_at": checked_at}
+
+    body = orjson.dumps({
+        "status": "ok" if healthy else "degraded",
+        "service": "telegram-image-bot",
+        "timestamp": now,
+        "uptime": round(now - STARTUP_TIME, 2),
+        "version": "1.0.0",
+        "uploads_processed": upload_counter.value,
+        "subsystems": subsystems
+    })
+    return body, (200 if healthy else 503)
+
+# The /info payload only changes on restart, so it is serialized once
+INFO_BODY = orjson.dumps({
+    "name": "Telegram Image Uploader Bot",
+    "description": "Upload images to ImgBB via Telegram",
+    "version": "1.0.0",
+    "max_file_size_mb": MAX_SIZE_MB,
+    "rate_limit": "10 uploads per minute per user",
+    "supported_formats": "JPEG, PNG, GIF, WEBP"
+})
+
 @flask_app.route("/health", methods=['GET', 'HEAD'])
 def health():
     """Comprehensive health check endpoint."""
+    body, status_code = _build_health_response()
     if request.method == 'HEAD':
-        return '', 200
+        return '', status_code
     
-    health_data = {
-        "status": "ok",
-        "service": "telegram-image-bot",
-        "timestamp": time.time(),
-        "uptime": round(time.time() - STARTUP_TIME, 2),
-        "version": "1.0.0",
-        "uploads_processed": UPLOAD_COUNTER
-    }
-    return jsonify(health_data)
+    return flask_app.response_class(body, status=status_code, mimetype='application/json')
 
 @flask_app.route("/info")
 def info():
     """Service information endpoint."""
-    return jsonify({
-        "name": "Telegram Image Uploader Bot",
-        "description": "Upload images to ImgBB via Telegram",
-        "version": "1.0.0",
-        "max_file_size_mb": getattr(config, 'MAX_SIZE_MB', 5),
-        "rate_limit": "10 uploads per minute per user",
-        "supported_formats": "JPEG, PNG, GIF, WEBP"
-    })
+    return flask_app.response_class(INFO_BODY, mimetype='application/json')
 
 @flask_app.errorhandler(404)
 def not_found(error):
@@ -456,62 +662,151 @@ def set_security_headers(response):
     response.headers['X-XSS-Protection'] = '1; mode=block'
     return response
 
-def run_flask():
-    """Run Flask app in a separate thread"""
-    logger.info(f"Starting Flask server on {config.FLASK_HOST}:{config.FLASK_PORT}")
+async def telegram_webhook(request: Request) -> Response:
+    """Queue an update that Telegram pushed to the webhook."""
+    application = request.app.state.application
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        return Response(status_code=403)
+
     try:
-        flask_app.run(
-            host=config.FLASK_HOST, 
-            port=config.FLASK_PORT, 
-            debug=False,
-            use_reloader=False
-        )
-    except Exception as e:
-        logger.error(f"Flask server failed: {e}")
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return Response(status_code=400)
+    if not isinstance(data, dict):
+        return Response(status_code=400)
+
+    try:
+        update = Update.de_json(data, application.bot)
+    except (AttributeError, TypeError, ValueError, KeyError):
+        return Response(status_code=400)
+    await application.update_queue.put(update)
+    return Response()
+
+def create_web_app(application: Application) -> Starlette:
+    """Mount Flask, and the webhook route if enabled, on one ASGI app."""
+    routes = []
+    if config.PUBLIC_URL:
+        routes.append(Route(WEBHOOK_PATH, telegram_webhook, methods=['POST']))
+    # Flask runs on a pool of worker threads, so slow requests do not queue behind each other
+    routes.append(Mount("/", app=WSGIMiddleware(flask_app, workers=FLASK_WORKERS)))
+
+    web_app = Starlette(routes=routes)
+    web_app.state.application = application
+    return web_app
 
 # --- TELEGRAM BOT HANDLERS ---
 
+# Static replies are rendered once at import; config does not change at runtime
+WELCOME_MESSAGE = (
+    "🤖 *Welcome to Image Uploader Bot!*\n\n"
+    "I can upload your images to ImgBB and provide you with direct links for sharing.\n\n"
+    "✨ *Features:*\n"
+    "• Fast image uploads to ImgBB\n"
+    "• Direct URLs for easy sharing\n"
+    "• Delete links for image management\n"
+    "• Quality preservation\n\n"
+    f"📁 *File Limit:* Max {MAX_SIZE_MB}MB per image\n"
+    "⚡ *Rate Limit:* 10 uploads per minute\n\n"
+    "📸 *How to use:* Just send me an image as a photo!\n"
+    "Use /help for detailed instructions."
+)
+
+HELP_MESSAGE = (
+    "📖 *How to Use This Bot*\n\n"
+    "1. *Send an Image:* Take a photo or choose one from your gallery\n"
+    "2. *Wait for Upload:* I'll process and upload it to ImgBB\n"
+    "3. *Get Your Links:* Receive direct URL and delete link\n\n"
+    "⚠️ *Important Notes:*\n"
+    "• Send images as *Photos* (not documents)\n"
+    f"• Maximum file size: {MAX_SIZE_MB}MB\n"
+    "• Rate limit: 10 uploads per minute\n"
+    "• Supported formats: JPEG, PNG, GIF, WEBP\n\n"
+    "🔧 *Commands:*\n"
+    "/start - Show welcome message\n"
+    "/help - Show this help message\n"
+    "/status - Check bot status\n\n"
+    "Need help? Contact the administrator."
+)
+
+# Only uptime and the upload count vary between /status calls
+STATUS_TEMPLATE = (
+    "📊 *Bot Status*\n\n"
+    "• 🟢 Online\n"
+    "• ⏰ Uptime: {hours}h {minutes}m {seconds}s\n"
+    "• 📈 Uploads Processed: {uploads}\n"
+    f"• 📁 Max File Size: {MAX_SIZE_MB}MB\n"
+    "• 🚦 Rate Limit: 10/min per user\n"
+    "• 🔄 Service: Operational\n\n"
+    "_All systems normal_"
+)
+
+RATE_LIMIT_MESSAGE = (
+    "🚫 *Rate Limit Exceeded*\n\n"
+    "You've made too many upload requests. Please wait a minute before trying again.\n"
+    "Limit: 10 uploads per minute."
+)
+
+FILE_TOO_LARGE_TEMPLATE = (
+    "🚫 *File Too Large*\n\n"
+    f"Your image is {{size_mb}}MB, but the maximum allowed is {MAX_SIZE_MB}MB.\n"
+    "Please send a smaller image."
+)
+
+# Failure replies; only the HTTP status and ImgBB error text vary
+FILE_LOOKUP_ERROR_MESSAGE = (
+    "❌ *Error*: Could not retrieve the file details from Telegram.\n"
+    "Please try again or send a different image."
+)
+
+DOWNLOAD_FAILED_MESSAGE = (
+    "❌ *Download Failed*\n\n"
+    "Could not download the image from Telegram servers.\n"
+    "Please check your connection and try again."
+)
+
+IMGBB_ERROR_TEMPLATE = (
+    "❌ *Upload Failed*\n\n"
+    "ImgBB returned an error:\n`{error_message}`\n\n"
+    "Please try again with a different image."
+)
+
+UPLOAD_TIMEOUT_MESSAGE = (
+    "❌ *Upload Timeout*\n\n"
+    "The upload took too long to complete.\n"
+    "Please try again with a smaller image or check your connection."
+)
+
+HTTP_ERROR_TEMPLATE = (
+    "❌ *Upload Failed*\n\n"
+    "HTTP Error: {status}\n"
+    "Please try again later."
+)
+
+CONNECTION_ERROR_MESSAGE = (
+    "❌ *Upload Failed*\n\n"
+    "Could not connect to the ImgBB server.\n"
+    "Please check your internet connection and try again."
+)
+
+UNEXPECTED_ERROR_MESSAGE = (
+    "❌ *Unexpected Error*\n\n"
+    "An unexpected error occurred during the upload process.\n"
+    "Please try again or contact support if the problem persists."
+)
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message and instructions on /start."""
-    welcome_message = (
-        "🤖 *Welcome to Image Uploader Bot!*\n\n"
-        "I can upload your images to ImgBB and provide you with direct links for sharing.\n\n"
-        "✨ *Features:*\n"
-        "• Fast image uploads to ImgBB\n"
-        "• Direct URLs for easy sharing\n"
-        "• Delete links for image management\n"
-        "• Quality preservation\n\n"
-        f"📁 *File Limit:* Max {getattr(config, 'MAX_SIZE_MB', 5)}MB per image\n"
-        "⚡ *Rate Limit:* 10 uploads per minute\n\n"
-        "📸 *How to use:* Just send me an image as a photo!\n"
-        "Use /help for detailed instructions."
-    )
     await update.message.reply_text(
-        welcome_message,
+        WELCOME_MESSAGE,
         parse_mode=constants.ParseMode.MARKDOWN,
         disable_web_page_preview=True
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends help instructions."""
-    help_message = (
-        "📖 *How to Use This Bot*\n\n"
-        "1. *Send an Image:* Take a photo or choose one from your gallery\n"
-        "2. *Wait for Upload:* I'll process and upload it to ImgBB\n"
-        "3. *Get Your Links:* Receive direct URL and delete link\n\n"
-        "⚠️ *Important Notes:*\n"
-        "• Send images as *Photos* (not documents)\n"
-        f"• Maximum file size: {getattr(config, 'MAX_SIZE_MB', 5)}MB\n"
-        "• Rate limit: 10 uploads per minute\n"
-        "• Supported formats: JPEG, PNG, GIF, WEBP\n\n"
-        "🔧 *Commands:*\n"
-        "/start - Show welcome message\n"
-        "/help - Show this help message\n"
-        "/status - Check bot status\n\n"
-        "Need help? Contact the administrator."
-    )
     await update.message.reply_text(
-        help_message,
+        HELP_MESSAGE,
         parse_mode=constants.ParseMode.MARKDOWN,
         disable_web_page_preview=True
     )
@@ -522,119 +817,167 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     hours, remainder = divmod(int(uptime), 3600)
     minutes, seconds = divmod(remainder, 60)
     
-    status_message = (
-        "📊 *Bot Status*\n\n"
-        f"• 🟢 Online\n"
-        f"• ⏰ Uptime: {hours}h {minutes}m {seconds}s\n"
-        f"• 📈 Uploads Processed: {UPLOAD_COUNTER}\n"
-        f"• 📁 Max File Size: {getattr(config, 'MAX_SIZE_MB', 5)}MB\n"
-        f"• 🚦 Rate Limit: 10/min per user\n"
-        f"• 🔄 Service: Operational\n\n"
-        "_All systems normal_"
-    )
     await update.message.reply_text(
-        status_message,
+        STATUS_TEMPLATE.format(hours=hours, minutes=minutes, seconds=seconds, uploads=upload_counter.value),
         parse_mode=constants.ParseMode.MARKDOWN
     )
 
+# Progress Message Class
+class ProgressMessage:
+    """Progress reply that is only sent if the upload is still running after a delay."""
+
+    def __init__(self, message, text: str, delay: float = PROGRESS_DELAY):
+        self.message = message
+        self.sent_message = None
+        self.sending = False
+        self.task = asyncio.create_task(self._send_later(text, delay))
+
+    async def _send_later(self, text: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self.sending = True
+        self.sent_message = await self.message.reply_text(text, parse_mode=constants.ParseMode.MARKDOWN)
+
+    async def edit_text(self, text: str, **kwargs):
+        """Show the final result, editing the progress reply if it went out."""
+        if self.sending:
+            # The progress reply is already on its way; wait so we edit it instead of adding another
+            try:
+                await self.task
+            except Exception as e:
+                logger.error(f"Could not send progress message: {e}")
+        else:
+            self.task.cancel()
+
+        if self.sent_message is not None:
+            return await self.sent_message.edit_text(text, **kwargs)
+        return await self.message.reply_text(text, **kwargs)
+
+# Download Payload Class
+class TelegramDownloadPayload(AsyncIterablePayload):
+    """Streams a Telegram download into an upload body that still has a Content-Length."""
+
+    def __init__(self, response: aiohttp.ClientResponse, **kwargs):
+        super().__init__(self._iter_chunks(response), **kwargs)
+        # A known size makes aiohttp send Content-Length instead of a chunked body
+        self._size = response.content_length
+        self.error = None
+
+    async def _iter_chunks(self, response: aiohttp.ClientResponse):
+        try:
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                yield chunk
+        except Exception as e:
+            # aiohttp reports this as a failure to send the upload; keep the real cause
+            self.error = e
+            raise
+
+def redact_token(error: Exception) -> str:
+    """Describe an error without the bot token that Telegram file URLs embed."""
+    text = str(error)
+    return text.replace(config.BOT_TOKEN, '<BOT_TOKEN>') if config.BOT_TOKEN else text
+
+async def fetch_file(context: ContextTypes.DEFAULT_TYPE, message, file_id: str):
+    """Get a file's details from Telegram, reusing a recent lookup; replies and returns None on failure."""
+    file = file_cache.get(file_id)
+    if file is None:
+        try:
+            file = await context.bot.get_file(file_id)
+        except Exception as e:
+            logger.error(f"Error retrieving file object for user {message.from_user.id}: {e}")
+            await message.reply_text(FILE_LOOKUP_ERROR_MESSAGE, parse_mode=constants.ParseMode.MARKDOWN)
+            return None
+        file_cache[file_id] = file
+    return file
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles incoming photo messages, checks size, and uploads to ImgBB."""
-    global UPLOAD_COUNTER
     message = update.message
     user_id = message.from_user.id
     
     # Check rate limiting
     if rate_limiter.is_limited(user_id):
-        await message.reply_text(
-            "🚫 *Rate Limit Exceeded*\n\n"
-            "You've made too many upload requests. Please wait a minute before trying again.\n"
-            "Limit: 10 uploads per minute.",
-            parse_mode=constants.ParseMode.MARKDOWN
-        )
+        await message.reply_text(RATE_LIMIT_MESSAGE, parse_mode=constants.ParseMode.MARKDOWN)
         return
     
-    # 1. Get the largest photo available
-    photo_file = message.photo[-1]
+    # 1. Get the largest photo available, or the image document
+    photo_file = message.photo[-1] if message.photo else message.document
     chat_id = message.chat_id
-    
-    # Send initial loading message
-    await context.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.UPLOAD_PHOTO)
-    
-    # 2. Get the file object to check size and download
-    try:
-        file = await context.bot.get_file(photo_file.file_id)
-    except Exception as e:
-        logger.error(f"Error retrieving file object for user {user_id}: {e}")
-        await message.reply_text(
-            "❌ *Error*: Could not retrieve the file details from Telegram.\n"
-            "Please try again or send a different image.",
-            parse_mode=constants.ParseMode.MARKDOWN
-        )
-        return
-    
-    # 3. Check the file size limit
-    file_size_mb = file.file_size / (1024 * 1024)
-    max_size_bytes = getattr(config, 'MAX_SIZE_BYTES', 5 * 1024 * 1024)
-    if file.file_size > max_size_bytes:
+
+    # 2. Take the size from the update when Telegram sent it, so oversized files skip getFile
+    file = None
+    size_bytes = photo_file.file_size
+    if not size_bytes:
+        file = await fetch_file(context, message, photo_file.file_id)
+        if file is None:
+            return
+        size_bytes = file.file_size
+
+    # 3. Check the file size limit (integer compare) and format the size once for replies
+    size_mb_str = f"{size_bytes / (1024 * 1024):.2f}"
+    if size_bytes > MAX_SIZE_BYTES:
         await message.reply_text(
-            f"🚫 *File Too Large*\n\n"
-            f"Your image is {file_size_mb:.2f}MB, but the maximum allowed is {getattr(config, 'MAX_SIZE_MB', 5)}MB.\n"
-            f"Please send a smaller image.",
+            FILE_TOO_LARGE_TEMPLATE.format(size_mb=size_mb_str),
             parse_mode=constants.ParseMode.MARKDOWN
         )
         return
 
-    # Send upload progress message
-    progress_msg = await message.reply_text(
-        f"📤 *Uploading Image*\n\n"
-        f"• Size: {file_size_mb:.2f}MB\n"
-        f"• Status: Downloading from Telegram...",
-        parse_mode=constants.ParseMode.MARKDOWN
-    )
+    # Send initial loading indicator, unless the upload will likely be over before it shows
+    if size_bytes >= SMALL_FILE_BYTES:
+        await context.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.UPLOAD_PHOTO)
+
+    if file is None:
+        file = await fetch_file(context, message, photo_file.file_id)
+        if file is None:
+            return
 
-    # 4. Download the file contents into memory
-    file_bytes = BytesIO()
+    progress_msg = None
+    telegram_response = None
     try:
-        await file.download_to_memory(file_bytes)
-        file_bytes.seek(0)
-    except Exception as e:
-        logger.error(f"Error downloading photo for user {user_id}: {e}")
-        await progress_msg.edit_text(
-            "❌ *Download Failed*\n\n"
-            "Could not download the image from Telegram servers.\n"
-            "Please check your connection and try again.",
-            parse_mode=constants.ParseMode.MARKDOWN
+        # Schedule the upload progress message; fast uploads finish before it is sent
+        progress_msg = ProgressMessage(
+            message,
+            f"📤 *Uploading Image*\n\n"
+            f"• Size: {size_mb_str}MB\n"
+            f"• Status: Transferring to ImgBB..."
         )
-        return
-
-    # Update progress message
-    await progress_msg.edit_text(
-        f"📤 *Uploading Image*\n\n"
-        f"• Size: {file_size_mb:.2f}MB\n"
-        f"• Status: Uploading to ImgBB...",
-        parse_mode=constants.ParseMode.MARKDOWN
-    )
 
-    # 5. Prepare and send the image to ImgBB
-    payload = {
-        'key': getattr(config, 'IMGBB_API_KEY', '')
-    }
-    
-    files = {
-        'image': ('image.jpg', file_bytes, 'image/jpeg')
-    }
+        session = context.bot_data['http_session']
 
-    try:
-        # Perform the HTTP POST request to ImgBB
-        imgbb_response = requests.post(
-            getattr(config, 'IMGBB_UPLOAD_URL', 'https://api.imgbb.com/1/upload'), 
-            data=payload, 
-            files=files,
-            timeout=30
+        # 4. Open a streaming download from Telegram instead of buffering it in memory
+        try:
+            telegram_response = await session.get(file.file_path, timeout=TELEGRAM_DOWNLOAD_TIMEOUT)
+            telegram_response.raise_for_status()
+            if telegram_response.content_length is None:
+                # Without a length the upload would go out chunked; buffer it so the body stays sized
+                image = await telegram_response.read()
+            else:
+                image = TelegramDownloadPayload(telegram_response)
+        except Exception as e:
+            logger.error(f"Error downloading photo for user {user_id}: {redact_token(e)}")
+            # The cached file_path may be the problem; look it up again on the next attempt
+            file_cache.pop(photo_file.file_id, None)
+            await progress_msg.edit_text(DOWNLOAD_FAILED_MESSAGE, parse_mode=constants.ParseMode.MARKDOWN)
+            return
+
+        # 5. Prepare the ImgBB form, piping the download body into the image field chunk by chunk
+        form = aiohttp.FormData()
+        form.add_field('key', IMGBB_API_KEY)
+        form.add_field(
+            'image',
+            image,
+            filename='image.jpg',
+            content_type='image/jpeg'
         )
-        imgbb_response.raise_for_status()
-        
-        data = imgbb_response.json()
+
+        # Perform the HTTP POST request to ImgBB without blocking the event loop
+        async with session.post(
+            IMGBB_UPLOAD_URL,
+            data=form,
+            timeout=IMGBB_UPLOAD_TIMEOUT
+        ) as imgbb_response:
+            imgbb_response.raise_for_status()
+            # orjson parses the raw bytes, skipping aiohttp's decode to str
+            data = orjson.loads(await imgbb_response.read())
 
         # 6. Process ImgBB response
         if data.get('success') and data.get('data'):
@@ -644,13 +987,13 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             image_title = image_data.get('title', 'Uploaded Image')
             
             # Update upload counter
-            UPLOAD_COUNTER += 1
+            upload_counter.increment()
             
             # Send the result back to the user
             success_message = (
                 "✅ *Upload Successful!*\n\n"
                 f"📷 *Title:* {image_title}\n"
-                f"📏 *Size:* {file_size_mb:.2f}MB\n"
+                f"📏 *Size:* {size_mb_str}MB\n"
                 f"🔗 *Direct URL:* `{image_url}`\n\n"
                 f"🗑️ *Delete URL:* `{delete_url}`\n\n"
                 "_You can use the delete link to remove the image from ImgBB later._"
@@ -659,53 +1002,45 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 success_message,
                 parse_mode=constants.ParseMode.MARKDOWN
             )
-            logger.info(f"Successfully uploaded image for user {user_id}, size: {file_size_mb:.2f}MB")
+            logger.info(f"Successfully uploaded image for user {user_id}, size: {size_mb_str}MB")
             
         else:
             error_message = data.get('error', {}).get('message', 'Unknown upload error.')
             logger.error(f"ImgBB API error for user {user_id}: {error_message}")
             await progress_msg.edit_text(
-                f"❌ *Upload Failed*\n\n"
-                f"ImgBB returned an error:\n`{error_message}`\n\n"
-                f"Please try again with a different image.",
+                IMGBB_ERROR_TEMPLATE.format(error_message=error_message),
                 parse_mode=constants.ParseMode.MARKDOWN
             )
 
-    except requests.exceptions.Timeout:
-        logger.error(f"ImgBB upload timeout for user {user_id}")
-        await progress_msg.edit_text(
-            "❌ *Upload Timeout*\n\n"
-            "The upload took too long to complete.\n"
-            "Please try again with a smaller image or check your connection.",
-            parse_mode=constants.ParseMode.MARKDOWN
-        )
-    except requests.exceptions.HTTPError as http_err:
+    except aiohttp.ClientResponseError as http_err:
         logger.error(f"HTTP error for user {user_id}: {http_err}")
         await progress_msg.edit_text(
-            f"❌ *Upload Failed*\n\n"
-            f"HTTP Error: {http_err.response.status_code}\n"
-            f"Please try again later.",
-            parse_mode=constants.ParseMode.MARKDOWN
-        )
-    except requests.exceptions.RequestException as req_err:
-        logger.error(f"Request error for user {user_id}: {req_err}")
-        await progress_msg.edit_text(
-            "❌ *Upload Failed*\n\n"
-            "Could not connect to the ImgBB server.\n"
-            "Please check your internet connection and try again.",
+            HTTP_ERROR_TEMPLATE.format(status=http_err.status),
             parse_mode=constants.ParseMode.MARKDOWN
         )
+    except (asyncio.TimeoutError, aiohttp.ClientError) as req_err:
+        # A Telegram stream failing mid-transfer surfaces here too, as an upload error
+        download_error = image.error if isinstance(image, TelegramDownloadPayload) else None
+        if download_error is not None:
+            logger.error(f"Error downloading photo for user {user_id}: {redact_token(download_error)}")
+            reply = DOWNLOAD_FAILED_MESSAGE
+        elif isinstance(req_err, asyncio.TimeoutError):
+            logger.error(f"ImgBB upload timeout for user {user_id}")
+            reply = UPLOAD_TIMEOUT_MESSAGE
+        else:
+            logger.error(f"Request error for user {user_id}: {redact_token(req_err)}")
+            reply = CONNECTION_ERROR_MESSAGE
+        await progress_msg.edit_text(reply, parse_mode=constants.ParseMode.MARKDOWN)
     except Exception as e:
-        logger.error(f"Unexpected error during upload for user {user_id}: {e}")
-        await progress_msg.edit_text(
-            "❌ *Unexpected Error*\n\n"
-            "An unexpected error occurred during the upload process.\n"
-            "Please try again or contact support if the problem persists.",
-            parse_mode=constants.ParseMode.MARKDOWN
-        )
+        logger.error(f"Unexpected error during upload for user {user_id}: {redact_token(e)}")
+        await progress_msg.edit_text(UNEXPECTED_ERROR_MESSAGE, parse_mode=constants.ParseMode.MARKDOWN)
     finally:
-        # Always close the BytesIO object
-        file_bytes.close()
+        # A failure before the final edit must not leave a progress reply scheduled
+        if progress_msg is not None:
+            progress_msg.task.cancel()
+        # Always release the Telegram download connection back to the pool
+        if telegram_response is not None:
+            telegram_response.release()
 
 async def handle_document_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle images sent as documents."""
@@ -755,22 +1090,139 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         except Exception as e:
             logger.error(f"Could not send error message to user: {e}")
 
+async def sweep_rate_limiter(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodically drop rate limiter state for idle users."""
+    rate_limiter.sweep()
+
+async def probe_health(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Check Telegram and ImgBB reachability and cache the results for /health."""
+    try:
+        await context.bot.get_me()
+        telegram_status = 'ok'
+    except Exception as e:
+        logger.warning(f"Telegram health probe failed: {e}")
+        telegram_status = 'error'
+
+    session = context.bot_data['http_session']
+    try:
+        async with session.head(
+            IMGBB_UPLOAD_URL,
+            timeout=aiohttp.ClientTimeout(total=5)
+        ) as response:
+            # Any answer short of a server error means ImgBB is reachable
+            imgbb_status = 'ok' if response.status < 500 else 'error'
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"ImgBB health probe failed: {e}")
+        imgbb_status = 'error'
+
+    checked_at = time.time()
+    subsystem_health['telegram'] = (telegram_status, checked_at)
+    subsystem_health['imgbb'] = (imgbb_status, checked_at)
+
+async def post_init(application: Application) -> None:
+    """Create the shared HTTP session used for ImgBB uploads."""
+    # Keep-alive connections and cached DNS answers are reused across uploads
+    connector = aiohttp.TCPConnector(
+        limit=50,
+        limit_per_host=20,
+        keepalive_timeout=60,
+        ttl_dns_cache=300
+    )
+    application.bot_data['http_session'] = aiohttp.ClientSession(connector=connector)
+
+async def post_shutdown(application: Application) -> None:
+    """Close the shared HTTP session on shutdown."""
+    session = application.bot_data.pop('http_session', None)
+    if session is not None:
+        await session.close()
+
 def validate_config():
     """Validate that all required configuration variables are present."""
-    required_vars = ['BOT_TOKEN', 'IMGBB_API_KEY']
+    required_vars = (
+        ('BOT_TOKEN', config.BOT_TOKEN),
+        ('IMGBB_API_KEY', IMGBB_API_KEY),
+    )
     
-    for var in required_vars:
-        if not hasattr(config, var):
-            raise ValueError(f"Missing required configuration: {var}")
-        
-        value = getattr(config, var)
+    for var, value in required_vars:
         if not value or value == f'your_{var.lower()}_here':
             raise ValueError(f"Please set the {var} in your configuration")
     
     logger.info("Configuration validation passed")
 
+# Web Server Class
+class ManagedServer(uvicorn.Server):
+    """uvicorn server that leaves SIGINT/SIGTERM handling to run_services."""
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        # uvicorn's version restores the previous handlers on exit and re-raises the signal,
+        # which kills the process before the bot has shut down
+        yield
+
+async def stop_services(application: Application) -> None:
+    """Stop receiving updates, then the application, then close the HTTP session."""
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await post_shutdown(application)
+
+async def run_services(application: Application) -> None:
+    """Run the bot and the web server together on the current event loop."""
+    # Keep idle connections open past the dashboard's 10s refresh so polls reuse them
+    server = ManagedServer(uvicorn.Config(
+        create_web_app(application),
+        host=config.FLASK_HOST,
+        port=config.FLASK_PORT,
+        timeout_keep_alive=30
+    ))
+
+    # A signal only asks uvicorn to exit; the bot is then stopped in the finally below
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, server.handle_exit, sig, None)
+        except NotImplementedError:
+            # Windows event loops have no add_signal_handler
+            signal.signal(sig, server.handle_exit)
+
+    async with application:
+        await post_init(application)
+        try:
+            await application.start()
+            if config.PUBLIC_URL:
+                # Telegram pushes updates to us instead of waiting on getUpdates long polls
+                logger.info("Starting Telegram bot webhook...")
+                await application.bot.set_webhook(
+                    url=f"{config.PUBLIC_URL.rstrip('/')}{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+            else:
+                logger.info("Starting Telegram bot polling...")
+                await application.updater.start_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+
+            # Serves until SIGINT/SIGTERM sets server.should_exit
+            logger.info(f"Web server starting on http://{config.FLASK_HOST}:{config.FLASK_PORT}")
+            await server.serve()
+        finally:
+            # Shield the cleanup so a cancellation cannot cut it short; re-raise it once done
+            cleanup = asyncio.ensure_future(stop_services(application))
+            cancelled = False
+            while not cleanup.done():
+                try:
+                    await asyncio.shield(cleanup)
+                except asyncio.CancelledError:
+                    cancelled = True
+            if cancelled:
+                raise asyncio.CancelledError
+
 def main() -> None:
-    """Start the bot and Flask server."""
+    """Start the bot and the web server."""
     
     # Validate configuration first
     try:
@@ -779,13 +1231,20 @@ def main() -> None:
         logger.error(f"Configuration error: {e}")
         raise
     
-    # Start Flask in a separate thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info(f"Flask server started on http://{config.FLASK_HOST}:{config.FLASK_PORT}")
-    
+    # Swap in the libuv-based event loop before PTB creates one
+    if uvloop is not None:
+        uvloop.install()
+        logger.info("Using uvloop event loop")
+
     # Create the Application and pass your bot's token
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .http_version("2")
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))
+        .concurrent_updates(PerChatUpdateProcessor())
+        .build()
+    )
 
     # Register handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -798,17 +1257,19 @@ def main() -> None:
     # Register error handler
     application.add_error_handler(error_handler)
 
+    # Keep the rate limiter from growing with every user ever seen
+    application.job_queue.run_repeating(sweep_rate_limiter, interval=rate_limiter.window)
+
+    # Refresh the cached subsystem health served by /health
+    application.job_queue.run_repeating(probe_health, interval=HEALTH_PROBE_INTERVAL, first=0)
+
     # Start the Bot
-    logger.info("Starting Telegram bot polling...")
-    logger.info(f"Bot is ready! Maximum file size: {getattr(config, 'MAX_SIZE_MB', 5)}MB")
+    logger.info(f"Bot is ready! Maximum file size: {MAX_SIZE_MB}MB")
     
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        asyncio.run(run_services(application))
     except Exception as e:
-        logger.error(f"Bot polling failed: {e}")
+        logger.error(f"Bot failed: {e}")
         raise
 
 if __name__ == '__main__':
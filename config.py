@@ -1,5 +1,5 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class Config:
@@ -9,10 +9,13 @@ class Config:
     IMGBB_UPLOAD_URL: str = "https://api.imgbb.com/1/upload"
     FLASK_PORT: int = 8000
     FLASK_HOST: str = "0.0.0.0"
+    PUBLIC_URL: str = ""
+    WEBHOOK_SECRET: str = ""
+    MAX_SIZE_BYTES: int = field(init=False, default=0)
     
-    @property
-    def MAX_SIZE_BYTES(self) -> int:
-        return self.MAX_SIZE_MB * 1024 * 1024
+    def __post_init__(self):
+        # Computed once so readers get a plain attribute instead of a property call
+        self.MAX_SIZE_BYTES = self.MAX_SIZE_MB * 1024 * 1024
 
 # Load configuration from environment variables
 config = Config(
@@ -20,7 +23,9 @@ config = Config(
     IMGBB_API_KEY=os.getenv("IMGBB_API_KEY", ""),
     MAX_SIZE_MB=int(os.getenv("MAX_SIZE_MB", "20")),
     FLASK_PORT=int(os.getenv("FLASK_PORT", "8000")),
-    FLASK_HOST=os.getenv("FLASK_HOST", "0.0.0.0")
+    FLASK_HOST=os.getenv("FLASK_HOST", "0.0.0.0"),
+    PUBLIC_URL=os.getenv("PUBLIC_URL", ""),
+    WEBHOOK_SECRET=os.getenv("WEBHOOK_SECRET", "")
 )
 
 # Validate required configuration